@@ -5,7 +5,7 @@ set -e
 
 # Configuration
 SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
-DAEMON_SCRIPT="$SCRIPT_DIR/enhanced_tray_daemon.py"
+DAEMON_SCRIPT="$SCRIPT_DIR/tray_daemon.py"
 VENV_DIR="$SCRIPT_DIR/venv"
 REQUIREMENTS_FILE="$SCRIPT_DIR/requirements.txt"
 LOG_FILE="$HOME/.cloudtolocalllm/tray_daemon.log"
@@ -69,19 +69,28 @@ setup_venv() {
 
 # Check if daemon is already running
 check_running() {
-    local port_file="$HOME/.cloudtolocalllm/tray_port"
-    
-    if [ -f "$port_file" ]; then
-        local port=$(cat "$port_file")
-        if netstat -tuln 2>/dev/null | grep -q ":$port "; then
-            log "Enhanced tray daemon is already running on port $port"
-            return 0
-        else
-            warning "Port file exists but daemon not responding, cleaning up..."
-            rm -f "$port_file"
-        fi
+    local endpoint_file="$HOME/.cloudtolocalllm/tray_endpoint"
+
+    if [ -f "$endpoint_file" ]; then
+        local endpoint=$(cat "$endpoint_file")
+        case "$endpoint" in
+            unix:*)
+                if [ -S "${endpoint#unix:}" ] && pgrep -f "tray_daemon.py" > /dev/null; then
+                    log "Enhanced tray daemon is already running on $endpoint"
+                    return 0
+                fi
+                ;;
+            tcp:*)
+                if netstat -tuln 2>/dev/null | grep -q ":${endpoint#tcp:} "; then
+                    log "Enhanced tray daemon is already running on port ${endpoint#tcp:}"
+                    return 0
+                fi
+                ;;
+        esac
+        warning "Endpoint file exists but daemon not responding, cleaning up..."
+        rm -f "$endpoint_file"
     fi
-    
+
     return 1
 }
 
@@ -122,24 +131,24 @@ stop_daemon() {
     log "Stopping CloudToLocalLLM Enhanced Tray Daemon..."
     
     # Find and kill daemon processes
-    pkill -f "enhanced_tray_daemon.py" || true
+    pkill -f "tray_daemon.py" || true
     
-    # Clean up port file
-    rm -f "$HOME/.cloudtolocalllm/tray_port"
+    # Clean up discovery files
+    rm -f "$HOME/.cloudtolocalllm/tray_endpoint" "$HOME/.cloudtolocalllm/tray_port"
     
     log "Enhanced tray daemon stopped"
 }
 
 # Show daemon status
 show_status() {
-    local port_file="$HOME/.cloudtolocalllm/tray_port"
-    
+    local endpoint_file="$HOME/.cloudtolocalllm/tray_endpoint"
+
     if check_running; then
-        local port=$(cat "$port_file")
-        log "Enhanced tray daemon is running on port $port"
-        
+        local endpoint=$(cat "$endpoint_file")
+        log "Enhanced tray daemon is running on $endpoint"
+
         # Show process info
-        pgrep -f "enhanced_tray_daemon.py" | while read pid; do
+        pgrep -f "tray_daemon.py" | while read pid; do
             log "Process: $pid ($(ps -p $pid -o comm=))"
         done
     else
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+AppIndicator smoke test for the CloudToLocalLLM tray daemon.
+
+Verifies that pystray can bring up a system tray icon on this machine
+(AppIndicator/GTK/Xorg backend) before the full daemon is installed.
+Run manually or from CI on a desktop-enabled runner:
+
+    python3 test_appindicator.py
+"""
+
+import sys
+import threading
+
+import pystray
+from PIL import Image
+
+
+def test_tray_startup(timeout: float = 3.0) -> bool:
+    """Start a minimal tray icon and wait for the backend to come up.
+
+    Uses pystray's setup callback to signal readiness the moment the
+    backend event loop is running, instead of sleeping a fixed interval
+    and inferring success from thread liveness. Returns as soon as the
+    icon is visible (typically well under timeout) and still catches
+    slow failures up to the full timeout.
+    """
+    ready = threading.Event()
+    icon = pystray.Icon(
+        "cloudtolocalllm-test",
+        icon=Image.new("RGBA", (16, 16), (76, 175, 80, 255)),
+        title="CloudToLocalLLM tray test",
+    )
+
+    def setup(icon):
+        icon.visible = True
+        ready.set()
+
+    tray_thread = threading.Thread(
+        target=icon.run, kwargs={"setup": setup}, daemon=True
+    )
+    tray_thread.start()
+
+    success = ready.wait(timeout=timeout)
+    icon.stop()
+    tray_thread.join(timeout=1.0)
+    return success
+
+
+def main() -> int:
+    print("Testing system tray support (pystray)...")
+    try:
+        if test_tray_startup():
+            print("✅ System tray icon started successfully")
+            return 0
+        print("❌ Tray backend did not become ready within timeout")
+        return 1
+    except Exception as e:
+        print(f"❌ Tray startup failed: {e}")
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
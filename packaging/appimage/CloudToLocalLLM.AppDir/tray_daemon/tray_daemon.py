@@ -0,0 +1,1323 @@
+#!/usr/bin/env python3
+"""
+CloudToLocalLLM System Tray Daemon
+
+Independent system tray daemon for CloudToLocalLLM. Provides the system tray
+icon, a socket IPC channel for the main Flutter application, and monitors
+the application lifecycle so the tray always reflects the real state.
+
+The daemon is intentionally self-contained: it embeds its icon assets,
+publishes its IPC endpoint for client discovery, and keeps running even when
+the main application exits (crash isolation).
+
+IPC transport: Unix domain socket on Linux/macOS (TCP loopback on Windows,
+or anywhere with --tcp). The active endpoint is published to
+~/.cloudtolocalllm/tray_endpoint for discovery.
+
+IPC framing: 1-byte opcode + 2-byte big-endian payload length. The first
+byte a client sends negotiates the protocol: anything except '{' selects
+binary framing; a '{' keeps the legacy newline-delimited JSON protocol for
+the life of the connection, so older clients work unchanged.
+
+Commands from the Flutter app:
+    PING, UPDATE_TOOLTIP, UPDATE_ICON, AUTH_STATUS, QUIT
+Commands to the Flutter app:
+    PONG, SHOW, HIDE, SETTINGS, QUIT
+"""
+
+import argparse
+import importlib.util
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import selectors
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+import psutil
+
+# pystray drags in the whole Xorg/GTK/AppIndicator backend chain at import
+# time, which dominates startup cost on GTK desktops; PIL is not far
+# behind. Resolve both lazily so --version/--help and early config errors
+# return in milliseconds instead of paying for backend bring-up.
+pystray = None
+Image = None
+
+
+def _load_tray_modules():
+    """Import pystray and PIL on first use and cache them module-wide."""
+    global pystray, Image
+    if pystray is None:
+        import pystray as _pystray
+        from PIL import Image as _Image
+        pystray = _pystray
+        Image = _Image
+
+
+# Shared transparent fallback icon; created once on first failure rather
+# than allocating a fresh 16x16 RGBA image every time a flapping backend
+# re-enters the error path. Lazy so importing the module stays PIL-free.
+_fallback_icon = None
+
+
+def _get_fallback_icon():
+    global _fallback_icon
+    if _fallback_icon is None:
+        _load_tray_modules()
+        _fallback_icon = Image.new("RGBA", (16, 16), (0, 0, 0, 0))
+    return _fallback_icon
+
+# watchdog is optional: with it installed the monitor loop wakes on
+# filesystem events in the config dir instead of relying purely on polling.
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+    WATCHDOG_AVAILABLE = True
+except ImportError:
+    WATCHDOG_AVAILABLE = False
+
+DAEMON_VERSION = "2.0.0"
+
+# Which pystray backends exist on this system; probed lazily once per
+# process (see _check_available_backends)
+_backend_probe_cache = None
+
+# Soft cap on concurrent IPC clients. Normal operation has one or two
+# (the Flutter app, maybe a settings UI); anything past this is a buggy
+# or hostile peer and gets closed at accept instead of consuming a read
+# buffer per socket.
+MAX_CLIENTS = 8
+
+# Suppress SIGPIPE per send on Linux; elsewhere the flag doesn't exist
+# and the process-wide SIGPIPE disposition (ignored in __init__ where
+# the platform has it) covers dead-peer writes instead.
+_SEND_FLAGS = getattr(socket, "MSG_NOSIGNAL", 0)
+
+# Scatter/gather writes (one syscall for several frames); absent on
+# some Windows builds, where sends fall back to a single send.
+_HAS_SENDMSG = hasattr(socket.socket, "sendmsg")
+
+# Hard cap on bytes queued for one client whose socket won't drain. IPC
+# frames are tiny, so a backlog near this size means the peer stopped
+# reading entirely; at that point it is closed rather than fed memory.
+_MAX_SEND_BACKLOG = 256 * 1024
+
+# Shared JSON codec instances: json.loads/dumps construct a fresh
+# decoder/encoder per call, which adds up at one message per IPC frame.
+# Compact separators also shave bytes off the wire. orjson, when
+# installed, replaces both directions (~6x decode / ~18x encode vs
+# stdlib) and works on bytes natively; stdlib remains the fallback.
+_DECODER = json.JSONDecoder()
+_ENCODER = json.JSONEncoder(separators=(",", ":"))
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    def _json_loads(data: bytes) -> dict:
+        return orjson.loads(data)
+
+    def _json_dumps(obj) -> bytes:
+        return orjson.dumps(obj)
+else:
+    def _json_loads(data: bytes) -> dict:
+        return _DECODER.decode(data.decode("utf-8"))
+
+    def _json_dumps(obj) -> bytes:
+        return _ENCODER.encode(obj).encode("utf-8")
+
+# Tray icons as raw RGBA pixels, rasterized once at import. The icons
+# are just filled state-colored circles, so drawing 256 pixels directly
+# is far cheaper than decoding an embedded PNG (zlib inflate + CRC +
+# filter unpacking) and keeps the module free of binary blobs.
+_ICON_SIZE = 16
+
+
+def _render_icon_pixels(rgba: bytes) -> bytes:
+    """Rasterize a filled circle in the given color to raw RGBA bytes."""
+    center = (_ICON_SIZE - 1) / 2.0
+    radius_sq = (_ICON_SIZE / 2.0 - 1.0) ** 2
+    pixels = bytearray(_ICON_SIZE * _ICON_SIZE * 4)
+    for y in range(_ICON_SIZE):
+        dy_sq = (y - center) ** 2
+        for x in range(_ICON_SIZE):
+            if (x - center) ** 2 + dy_sq <= radius_sq:
+                offset = (y * _ICON_SIZE + x) * 4
+                pixels[offset:offset + 4] = rgba
+    return bytes(pixels)
+
+
+_ICON_PIXELS = {
+    "idle": _render_icon_pixels(b"\x80\x80\x80\xff"),       # grey
+    "connected": _render_icon_pixels(b"\x4c\xaf\x50\xff"),  # green
+    "error": _render_icon_pixels(b"\xf4\x43\x36\xff"),      # red
+}
+
+# Binary IPC framing: opcode + payload length. The hot commands
+# (UPDATE_ICON/UPDATE_TOOLTIP heartbeats) carry their argument as raw
+# UTF-8 bytes, so no JSON parsing happens on that path at all.
+_FRAME_HEADER = struct.Struct(">BH")
+
+OP_PING = 0x01
+OP_PONG = 0x02
+OP_SHOW = 0x03
+OP_HIDE = 0x04
+OP_SETTINGS = 0x05
+OP_QUIT = 0x06
+OP_UPDATE_TOOLTIP = 0x07
+OP_UPDATE_ICON = 0x08
+OP_AUTH_STATUS = 0x09
+
+_CMD_TO_OP = {
+    "PING": OP_PING,
+    "PONG": OP_PONG,
+    "SHOW": OP_SHOW,
+    "HIDE": OP_HIDE,
+    "SETTINGS": OP_SETTINGS,
+    "QUIT": OP_QUIT,
+    "UPDATE_TOOLTIP": OP_UPDATE_TOOLTIP,
+    "UPDATE_ICON": OP_UPDATE_ICON,
+    "AUTH_STATUS": OP_AUTH_STATUS,
+}
+
+# Candidate install locations for the main app, built once at import.
+# Only the current platform's tuple exists; _find_app_executable walks it
+# just when its cached hit has disappeared.
+if sys.platform == "win32":
+    _APP_CANDIDATES = (
+        str(
+            Path(
+                os.environ.get(
+                    "LOCALAPPDATA", str(Path.home() / "AppData" / "Local")
+                )
+            )
+            / "CloudToLocalLLM"
+            / "cloudtolocalllm.exe"
+        ),
+        str(
+            Path(os.environ.get("PROGRAMFILES", "C:\\Program Files"))
+            / "CloudToLocalLLM"
+            / "cloudtolocalllm.exe"
+        ),
+    )
+elif sys.platform == "darwin":
+    _APP_CANDIDATES = (
+        "/Applications/CloudToLocalLLM.app/Contents/MacOS/cloudtolocalllm",
+        str(
+            Path.home() / "Applications" / "CloudToLocalLLM.app"
+            / "Contents" / "MacOS" / "cloudtolocalllm"
+        ),
+    )
+else:
+    _APP_CANDIDATES = (
+        "/usr/bin/cloudtolocalllm",
+        "/opt/cloudtolocalllm/cloudtolocalllm",
+        str(Path.home() / ".local" / "bin" / "cloudtolocalllm"),
+        str(Path(__file__).parent.parent / "usr" / "bin" / "cloudtolocalllm"),
+    )
+
+
+class TrayDaemon:
+    """System tray daemon with socket IPC for the main Flutter app."""
+
+    def __init__(self, debug: bool = False, use_tcp: bool = False):
+        self.debug = debug
+        # AF_UNIX skips the TCP stack (checksums, handshake, Nagle) for the
+        # common local case; TCP loopback remains for Windows and as an
+        # explicit opt-in fallback for older clients.
+        self.use_tcp = use_tcp or sys.platform == "win32"
+        self.running = False
+        self.port = 0
+
+        # IPC state
+        self.server_socket: Optional[socket.socket] = None
+        # Set, not list: disconnect cleanup and membership checks are O(1)
+        # even across many short-lived Flutter reconnects. The selector
+        # thread mutates it while the tray and monitor threads read it, so
+        # mutations and snapshots go through _clients_lock.
+        self.client_connections: set = set()
+        self._clients_lock = threading.Lock()
+        self._selector: Optional[selectors.DefaultSelector] = None
+        self._client_buffers = {}
+        # Clients that negotiated binary framing (first byte wasn't '{')
+        self._binary_clients = set()
+        # Per-client output backlogs: bytes a non-blocking send couldn't
+        # hand to the kernel, drained when the selector reports writable
+        self._client_out = {}
+
+        # Without MSG_NOSIGNAL (macOS), a write to a dead peer raises
+        # SIGPIPE and kills the process before the except around sendall
+        # can run; ignore it process-wide so the error surfaces as a
+        # catchable BrokenPipeError instead.
+        if not _SEND_FLAGS and hasattr(signal, "SIGPIPE"):
+            signal.signal(signal.SIGPIPE, signal.SIG_IGN)
+
+        # Tray state
+        self.tray: Optional["pystray.Icon"] = None
+        self.icon_state = "idle"
+        self.tooltip = "CloudToLocalLLM"
+        self.tray_degraded = False
+        self._icon_cache = {}
+
+        # Pending tray updates, coalesced on a short timer so rapid state
+        # flaps (connecting -> connected -> error) cost one redraw, not three
+        self._pending_icon = None
+        self._pending_tooltip = None
+        self._flush_timer: Optional[threading.Timer] = None
+        self._flush_lock = threading.Lock()
+
+        # Application state
+        self.app_process: Optional[subprocess.Popen] = None
+        # PID found by the last full process scan; lets subsequent polls
+        # use an O(1) pid_exists check instead of rescanning /proc
+        self._app_pid: Optional[int] = None
+        # Executable path found by the last candidate walk
+        self._app_executable: Optional[str] = None
+        self.app_is_running = False
+        self.app_is_authenticated = False
+
+        # Worker threads
+        self.tray_thread: Optional[threading.Thread] = None
+
+        # Self-pipe pair registered with the selector; _request_poll writes
+        # a byte so the watcher (or another thread) can interrupt select
+        # instead of waiting out the full poll timeout
+        self._wake_r: Optional[socket.socket] = None
+        self._wake_w: Optional[socket.socket] = None
+        self._poll_now = False
+        self._state_observer = None
+
+        # Monitor cadence: 2s while state is changing, backing off 1.5x to
+        # 15s during quiet stretches. Any change, error, or event wake
+        # resets to the floor.
+        self._poll_interval = 2.0
+        self._min_poll = 2.0
+        self._max_poll = 15.0
+        self._backoff = 1.5
+
+        # These paths never change for the life of the daemon, so resolve
+        # them once here instead of re-resolving Path.home() and the
+        # platform branch on every shutdown/monitor/status call.
+        # Resolved (and mkdir'd) exactly once per process; every other
+        # path hangs off the cached directory
+        self._config_dir = self._resolve_config_dir()
+        self._log_path = self._config_dir / "tray.log"
+        self._port_file_path = self._config_dir / "tray_port"
+        self._endpoint_file_path = self._config_dir / "tray_endpoint"
+        self._socket_path = self._config_dir / "tray.sock"
+
+        self._log_listener: Optional[logging.handlers.QueueListener] = None
+
+        # Command dispatch for the legacy JSON path: one dict lookup per
+        # message instead of a chain of string compares
+        self._handlers = {
+            "UPDATE_TOOLTIP": lambda data: self._handle_update_tooltip(
+                data.get("tooltip", "CloudToLocalLLM")
+            ),
+            "UPDATE_ICON": lambda data: self._handle_update_icon(
+                data.get("state", "idle")
+            ),
+            "AUTH_STATUS": lambda data: self._handle_auth_status(
+                bool(data.get("authenticated", False))
+            ),
+            "PING": lambda data: self._handle_ping(),
+            "QUIT": lambda data: self.shutdown(),
+        }
+
+        self._setup_logging(debug)
+
+    # ------------------------------------------------------------------
+    # Paths and logging
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _resolve_config_dir() -> Path:
+        """Resolve and create the CloudToLocalLLM config directory.
+
+        Called once from __init__; everything else reads the cached
+        self._config_dir instead of re-resolving (and re-mkdir'ing) the
+        directory per access.
+        """
+        if sys.platform == "win32":
+            base = os.environ.get("LOCALAPPDATA", str(Path.home() / "AppData" / "Local"))
+            config_dir = Path(base) / "CloudToLocalLLM"
+        else:
+            config_dir = Path.home() / ".cloudtolocalllm"
+        config_dir.mkdir(parents=True, exist_ok=True)
+        return config_dir
+
+    def _setup_logging(self, debug: bool):
+        """Configure logging with file I/O on a background listener thread.
+
+        A plain FileHandler performs a blocking write (and flush) on the
+        calling thread for every record, including inside the IPC fast
+        path. Producers now only enqueue records via a QueueHandler; a
+        QueueListener thread does the actual file/stream writes.
+        """
+        log_level = logging.DEBUG if debug else logging.INFO
+        formatter = logging.Formatter(
+            "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
+        )
+
+        file_handler = logging.FileHandler(self._log_path)
+        file_handler.setFormatter(formatter)
+        handlers = [file_handler]
+        if debug:
+            stream_handler = logging.StreamHandler()
+            stream_handler.setFormatter(formatter)
+            handlers.append(stream_handler)
+
+        log_queue = queue.SimpleQueue()
+        root = logging.getLogger()
+        root.setLevel(log_level)
+        root.addHandler(logging.handlers.QueueHandler(log_queue))
+
+        self._log_listener = logging.handlers.QueueListener(
+            log_queue, *handlers, respect_handler_level=True
+        )
+        self._log_listener.start()
+        self.logger = logging.getLogger("tray_daemon")
+
+    # ------------------------------------------------------------------
+    # Icons
+    # ------------------------------------------------------------------
+
+    def _create_icon_image(self, state: str) -> "Image.Image":
+        """Return the (cached) PIL Image for the given icon state.
+
+        There are only three states, so each one is wrapped exactly once
+        — frombuffer adopts the raw pixels without any decoding — and
+        every subsequent icon swap is a dict lookup.
+        """
+        if state not in _ICON_PIXELS:
+            state = "idle"  # alias unknown states to the one cached image
+        image = self._icon_cache.get(state)
+        if image is not None:
+            return image
+        _load_tray_modules()
+        try:
+            image = Image.frombuffer(
+                "RGBA", (_ICON_SIZE, _ICON_SIZE), _ICON_PIXELS[state],
+                "raw", "RGBA", 0, 1,
+            )
+            self._icon_cache[state] = image
+            return image
+        except Exception as e:
+            self.logger.error("Failed to create icon image for '%s': %s", state, e)
+            # Transparent fallback so the tray still shows something clickable
+            return _get_fallback_icon()
+
+    def _export_icon_files(self):
+        """Write the icon PNGs to <config>/icons for external use.
+
+        pystray's API requires a PIL Image for the tray icon itself, but
+        the exported files let everything else — icon-theme lookup, the
+        Flutter client, desktop notifications — reference the icons by
+        path. The icons live in memory as raw pixels now, so export
+        encodes them with PIL; files are only written when missing, which
+        keeps steady-state startups at three stats and no encoding.
+
+        Runs before the tray thread, so any failure here — a read-only
+        config dir, or pystray/PIL missing entirely (ImportError out of
+        _load_tray_modules) — must stay non-fatal: the daemon still has
+        to reach IPC-only degraded mode.
+        """
+        icons_dir = self._config_dir / "icons"
+        try:
+            icons_dir.mkdir(exist_ok=True)
+            for state in _ICON_PIXELS:
+                path = icons_dir / f"{state}.png"
+                if path.exists():
+                    continue
+                self._create_icon_image(state).save(path, "PNG")
+        except Exception as e:
+            self.logger.warning("Failed to export icon files: %s", e)
+
+    # ------------------------------------------------------------------
+    # Tray support detection
+    # ------------------------------------------------------------------
+
+    def _check_available_backends(self):
+        """Probe which pystray backends exist on this system.
+
+        find_spec only walks the import path — unlike executing the
+        imports, it can't trigger GTK/D-Bus bring-up as a side effect.
+        Availability can't change within a process, so the result is
+        cached module-wide and later calls are free.
+        """
+        global _backend_probe_cache
+        if _backend_probe_cache is None:
+            backends = []
+            for module in (
+                "pystray._appindicator", "pystray._gtk", "pystray._xorg"
+            ):
+                try:
+                    if importlib.util.find_spec(module) is not None:
+                        backends.append(module.rsplit("_", 1)[1])
+                except (ImportError, ValueError):
+                    continue
+            _backend_probe_cache = backends
+        return _backend_probe_cache
+
+    # ------------------------------------------------------------------
+    # Menu
+    # ------------------------------------------------------------------
+
+    def _create_menu(self) -> "pystray.Menu":
+        """Build the tray menu once, with items that read live daemon state.
+
+        pystray accepts callables for text/visible/enabled, so the menu
+        structure is static and state changes only need tray.update_menu()
+        instead of tearing down and re-registering every item (a full DBus
+        round-trip per item under AppIndicator).
+        """
+        _load_tray_modules()
+        return pystray.Menu(
+            pystray.MenuItem(
+                lambda item: (
+                    f"Status: "
+                    f"{'Connected' if self.icon_state == 'connected' else 'Disconnected'}"
+                ),
+                None,
+                enabled=False,
+            ),
+            pystray.Menu.SEPARATOR,
+            pystray.MenuItem(
+                "Show Window", self._on_show,
+                visible=lambda item: self.app_is_running,
+            ),
+            pystray.MenuItem(
+                "Hide Window", self._on_hide,
+                visible=lambda item: self.app_is_running,
+            ),
+            pystray.MenuItem(
+                "Launch CloudToLocalLLM", self._on_launch,
+                visible=lambda item: not self.app_is_running,
+            ),
+            pystray.MenuItem("Settings", self._on_settings),
+            pystray.Menu.SEPARATOR,
+            pystray.MenuItem("Quit", self._on_quit),
+        )
+
+    def _on_show(self, icon, item):
+        self._send_to_clients({"command": "SHOW"})
+
+    def _on_hide(self, icon, item):
+        self._send_to_clients({"command": "HIDE"})
+
+    def _on_settings(self, icon, item):
+        self._send_to_clients({"command": "SETTINGS"})
+
+    def _on_launch(self, icon, item):
+        self._launch_app()
+
+    def _on_quit(self, icon, item):
+        self._send_to_clients({"command": "QUIT"})
+        self.shutdown()
+
+    # ------------------------------------------------------------------
+    # Application lifecycle
+    # ------------------------------------------------------------------
+
+    def _find_app_executable(self) -> Optional[str]:
+        """Locate the main CloudToLocalLLM executable for this platform.
+
+        The first hit is cached; later calls cost a single os.path.isfile
+        on the cached path, and the candidate tuple is only re-walked if
+        that path has since disappeared (e.g. after a reinstall).
+        """
+        if self._app_executable is not None and os.path.isfile(
+            self._app_executable
+        ):
+            return self._app_executable
+        self._app_executable = None
+        for candidate in _APP_CANDIDATES:
+            if os.path.isfile(candidate):
+                self._app_executable = candidate
+                break
+        return self._app_executable
+
+    def _launch_app(self):
+        """Launch the main CloudToLocalLLM application."""
+        executable = self._find_app_executable()
+        if not executable:
+            self.logger.error("CloudToLocalLLM executable not found")
+            return
+        try:
+            self.app_process = subprocess.Popen(
+                [executable],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                start_new_session=True,
+            )
+            self.logger.info("Launched CloudToLocalLLM (PID %s)", self.app_process.pid)
+        except Exception as e:
+            self.logger.error("Failed to launch CloudToLocalLLM: %s", e)
+
+    def _is_app_running(self) -> bool:
+        """Check whether the main CloudToLocalLLM application is running.
+
+        A full psutil.process_iter walk costs a /proc read (and an internal
+        create_time PID-reuse check) per process on the system, every 2s.
+        Two fast paths avoid it: when the daemon launched the app itself,
+        Popen.poll() answers directly; otherwise the PID found by the last
+        scan is rechecked with an O(1) pid_exists. The scan only runs when
+        neither shortcut applies.
+        """
+        if self.app_process is not None:
+            if self.app_process.poll() is None:
+                return True
+            self.app_process = None  # Reaped; fall through to the scan
+
+        if self._app_pid is not None:
+            if psutil.pid_exists(self._app_pid):
+                return True
+            self._app_pid = None
+
+        try:
+            # Only ask process_iter for the pid; name and cmdline are read
+            # inside oneshot(), which batches the per-process /proc reads
+            # and skips the cmdline fetch entirely on a name match.
+            for proc in psutil.process_iter(["pid"]):
+                try:
+                    with proc.oneshot():
+                        name = (proc.name() or "").lower()
+                        if "cloudtolocalllm" in name:
+                            self._app_pid = proc.pid
+                            return True
+                        # Check each argument in place rather than joining
+                        # the whole cmdline into a throwaway string
+                        cmdline = [
+                            (arg or "").lower() for arg in proc.cmdline() or []
+                        ]
+                        if any(
+                            "cloudtolocalllm" in arg for arg in cmdline
+                        ) and not any("tray_daemon" in arg for arg in cmdline):
+                            self._app_pid = proc.pid
+                            return True
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    continue
+        except Exception as e:
+            self.logger.error("Process scan failed: %s", e)
+        return False
+
+    def _is_app_authenticated(self) -> bool:
+        """Check whether an authenticated app instance is connected over IPC.
+
+        The selector loop discards a client the moment a read fails or
+        returns EOF, so the set's contents are authoritative — no need to
+        probe each socket's private _closed flag per poll.
+        """
+        return self.app_is_authenticated and bool(self.client_connections)
+
+    def _start_state_watcher(self):
+        """Watch the config directory so state changes wake the monitor loop.
+
+        The main app touches files under the config dir (auth tokens, port
+        file) on the transitions we care about; an inotify-backed watch lets
+        the monitor react immediately instead of waiting out its poll
+        interval. Polling stays in place as the fallback on systems without
+        watchdog installed.
+        """
+        if not WATCHDOG_AVAILABLE:
+            self.logger.debug("watchdog not available, using polling only")
+            return
+        daemon = self
+
+        def _is_self_write(path: str) -> bool:
+            # The daemon's own writes land in the watched directory: every
+            # log record hits tray.log and startup exports the icon PNGs.
+            # Re-polling on those would defeat the adaptive backoff — and a
+            # poll tick that logs would self-sustain (log write -> inotify
+            # event -> immediate re-poll -> log write) with no sleep.
+            name = os.path.basename(path)
+            return (
+                name == "tray.log"
+                or name == "icons"
+                or os.path.basename(os.path.dirname(path)) == "icons"
+            )
+
+        class _StateChangeHandler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                for path in (event.src_path,
+                             getattr(event, "dest_path", None)):
+                    if path and not _is_self_write(path):
+                        daemon._request_poll()
+                        return
+
+        try:
+            self._state_observer = Observer()
+            self._state_observer.schedule(
+                _StateChangeHandler(), str(self._config_dir)
+            )
+            self._state_observer.daemon = True
+            self._state_observer.start()
+            self.logger.info("Filesystem state watcher started")
+        except Exception as e:
+            self._state_observer = None
+            self.logger.warning("Filesystem watcher unavailable: %s", e)
+
+    def _check_app_state(self):
+        """Run one app-state poll tick and keep the tray icon/menu in sync.
+
+        Called inline from the selector loop when its poll deadline
+        expires, so all app-state mutations happen on that one thread.
+        Adjusts the adaptive interval: floor on any change, backed off
+        toward the cap while nothing is happening.
+        """
+        try:
+            current_running_state = self._is_app_running()
+            current_auth_state = self._is_app_authenticated()
+            state_changed = (
+                current_running_state != self.app_is_running
+                or current_auth_state != self.app_is_authenticated
+            )
+
+            # Dirty flags are computed before mutating state: the old
+            # code compared against already-updated attributes, so the
+            # menu-refresh condition was always False and rebuilds were
+            # silently skipped.
+            new_icon_state = "connected" if current_auth_state else "idle"
+            icon_dirty = new_icon_state != self.icon_state
+
+            self.app_is_running = current_running_state
+            self.app_is_authenticated = current_auth_state
+
+            if icon_dirty:
+                self.icon_state = new_icon_state
+                if self.tray:
+                    self.tray.icon = self._create_icon_image(self.icon_state)
+            if state_changed and self.tray:
+                self.tray.update_menu()
+        except Exception as e:
+            self.logger.error("App state monitor error: %s", e)
+            state_changed = True  # stay responsive after errors
+        if state_changed:
+            self._poll_interval = self._min_poll
+        else:
+            self._poll_interval = min(
+                self._poll_interval * self._backoff, self._max_poll
+            )
+
+    def _request_poll(self):
+        """Collapse the poll backoff and wake the selector loop.
+
+        Safe to call from any thread: the byte written to the wake pipe
+        interrupts sel.select immediately, so a state change is picked up
+        without waiting out the current (possibly 15s) poll timeout.
+        """
+        self._poll_now = True
+        if self._wake_w is not None:
+            try:
+                self._wake_w.send(b"\x00")
+            except OSError:
+                pass
+
+    def _drain_wake(self, sock: socket.socket):
+        """Consume pending wake bytes so the pipe doesn't stay readable."""
+        try:
+            sock.recv(1024)
+        except OSError:
+            pass
+
+    # ------------------------------------------------------------------
+    # IPC server
+    # ------------------------------------------------------------------
+
+    def start_server(self):
+        """Start the IPC server on a Unix socket (or TCP loopback fallback).
+
+        All sockets are served by a single selector-driven thread: the
+        daemon only shuttles tiny JSON commands, so one thread multiplexing
+        reads replaces the old thread-per-client model (8 MB stack and GIL
+        contention per connection) with O(1) threads.
+        """
+        if self.use_tcp:
+            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server_socket.setsockopt(
+                socket.SOL_SOCKET, socket.SO_REUSEADDR, 1
+            )
+            self.server_socket.bind(("127.0.0.1", 0))
+            self.port = self.server_socket.getsockname()[1]
+            endpoint = f"tcp:{self.port}"
+        else:
+            self.server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                self._socket_path.unlink()  # Stale socket from a dead daemon
+            except FileNotFoundError:
+                pass
+            self.server_socket.bind(str(self._socket_path))
+            os.chmod(self._socket_path, 0o600)
+            endpoint = f"unix:{self._socket_path}"
+        self.server_socket.listen(5)
+        self.server_socket.setblocking(False)
+
+        # Publish the endpoint for client discovery. The legacy tray_port
+        # file is still written in TCP mode for older clients.
+        self._publish_discovery_file(self._endpoint_file_path, endpoint)
+        if self.use_tcp:
+            self._publish_discovery_file(self._port_file_path, str(self.port))
+
+        self.logger.info("IPC server listening on %s", endpoint)
+
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(
+            self.server_socket, selectors.EVENT_READ, self._accept_client
+        )
+
+        # Self-pipe so other threads can interrupt select (see _request_poll)
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._selector.register(
+            self._wake_r, selectors.EVENT_READ, self._drain_wake
+        )
+
+    def _publish_discovery_file(self, path: Path, content: str):
+        """Atomically publish a discovery file for client consumption.
+
+        A plain open('w') is non-atomic: a Flutter client racing daemon
+        startup could read a truncated or empty file (and treat it as port
+        0). Write to a temp file in the same directory, fsync, then
+        os.replace so readers always see either the old or the complete
+        new contents. Raw os.open/os.write skips the text-I/O layer
+        (encoding, newline translation, buffering) for this few-byte
+        payload, and the 0o600 mode is set at create time instead of a
+        separate chmod.
+        """
+        tmp = path.with_suffix(".tmp")
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            os.write(fd, content.encode("utf-8"))
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(tmp, path)
+
+    def _serve_ipc(self):
+        """Multiplex IPC sockets and the app-state poll on one selector.
+
+        The poll tick that used to live on its own monitor thread runs
+        inline here: select's timeout is derived from the next poll
+        deadline, so an idle daemon sleeps the whole interval in a single
+        syscall instead of splitting it across two threads, and a wake
+        byte on the self-pipe brings the tick forward immediately.
+        """
+        next_poll = time.monotonic()  # first tick runs right away
+        while self.running:
+            timeout = max(0.0, next_poll - time.monotonic())
+            try:
+                events = self._selector.select(timeout=timeout)
+            except OSError:
+                break  # Selector closed during shutdown
+            for key, _ in events:
+                callback = key.data
+                try:
+                    callback(key.fileobj)
+                except Exception as e:
+                    if self.running:
+                        self.logger.error("IPC loop error: %s", e)
+            if not self.running:
+                break
+            if self._poll_now or time.monotonic() >= next_poll:
+                woken = self._poll_now
+                self._poll_now = False
+                self._check_app_state()
+                if woken:
+                    # Explicit wakes collapse the backoff even when the
+                    # tick itself saw no change yet
+                    self._poll_interval = self._min_poll
+                next_poll = time.monotonic() + self._poll_interval
+
+    def _accept_client(self, server_socket: socket.socket):
+        """Accept an incoming IPC connection and register it for reads."""
+        try:
+            client_socket, address = server_socket.accept()
+        except OSError:
+            return
+        if len(self.client_connections) >= MAX_CLIENTS:
+            self.logger.warning(
+                "Rejecting IPC client (cap of %d reached)", MAX_CLIENTS
+            )
+            try:
+                client_socket.close()
+            except OSError:
+                pass
+            return
+        if client_socket.family == socket.AF_INET:
+            # IPC messages are small JSON blobs the client blocks on;
+            # without TCP_NODELAY, Nagle can hold responses for up to
+            # 40ms while the loopback socket has unacked data.
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            client_socket.setsockopt(
+                socket.SOL_SOCKET, socket.SO_SNDBUF, 64 * 1024
+            )
+        client_socket.setblocking(False)
+        self.logger.info("Client connected from %s", address or "local socket")
+        with self._clients_lock:
+            self.client_connections.add(client_socket)
+        # Preallocated read buffer, fill count, and framing mode (None
+        # until the connection's first byte decides it; True = binary).
+        # recv_into appends in place so steady-state reads allocate
+        # nothing; 64 KiB matches the send-buffer sizing above, so a full
+        # socket buffer drains in one recv_into with no mid-stream grow.
+        self._client_buffers[client_socket] = [bytearray(65536), 0, None]
+        self._selector.register(
+            client_socket, selectors.EVENT_READ, self._read_client
+        )
+
+    def _read_client(self, client_socket: socket.socket):
+        """Read available bytes from a client and process complete frames.
+
+        recv_into fills a preallocated per-client bytearray, so the read
+        path allocates nothing in steady state (the old recv+concat version
+        produced a fresh bytes object and a re-copied buffer per read).
+        Frames are scanned in place and the unconsumed tail is compacted to
+        the front of the buffer once per read, not per message.
+        """
+        state = self._client_buffers[client_socket]
+        buf, used = state[0], state[1]
+        if used == len(buf):
+            # A single frame larger than the buffer: grow it
+            buf.extend(bytes(len(buf)))
+        try:
+            n = client_socket.recv_into(memoryview(buf)[used:])
+        except (BlockingIOError, InterruptedError):
+            return
+        except (ConnectionResetError, OSError):
+            n = 0
+        if n == 0:
+            self._close_client(client_socket)
+            return
+        if state[2] is None:
+            # Only the connection's very first byte negotiates framing
+            # ('{' keeps legacy JSON mode). The drained buffer returns to
+            # used == 0 after every read, so deciding on buf[0] each time
+            # a read starts at offset 0 would reclassify a legacy client
+            # whose next line begins with whitespace (or the malformed
+            # input _process_message tolerates) and permanently desync it.
+            state[2] = buf[0] != 0x7B
+            if state[2]:
+                self._binary_clients.add(client_socket)
+        used += n
+        start = 0
+        if state[2]:
+            header = _FRAME_HEADER.size
+            while used - start >= header:
+                op, length = _FRAME_HEADER.unpack_from(buf, start)
+                end = start + header + length
+                if used < end:
+                    break
+                self._process_frame(op, bytes(buf[start + header:end]))
+                start = end
+        else:
+            while (idx := buf.find(b"\n", start, used)) != -1:
+                line = bytes(buf[start:idx]).strip()
+                start = idx + 1
+                if line:
+                    self._process_message(line)
+        if start:
+            buf[: used - start] = buf[start:used]
+            used -= start
+        state[1] = used
+
+    def _close_client(self, client_socket: socket.socket):
+        """Unregister and close a client connection."""
+        try:
+            self._selector.unregister(client_socket)
+        except (KeyError, ValueError):
+            pass
+        self._client_buffers.pop(client_socket, None)
+        self._client_out.pop(client_socket, None)
+        self._binary_clients.discard(client_socket)
+        with self._clients_lock:
+            self.client_connections.discard(client_socket)
+        try:
+            client_socket.close()
+        except OSError:
+            pass
+        self.logger.info("Client disconnected")
+
+    def _process_frame(self, op: int, payload: bytes):
+        """Dispatch a binary frame. Hot ops carry raw UTF-8, no JSON."""
+        if op == OP_UPDATE_TOOLTIP:
+            self._handle_update_tooltip(
+                payload.decode("utf-8") or "CloudToLocalLLM"
+            )
+        elif op == OP_UPDATE_ICON:
+            self._handle_update_icon(payload.decode("utf-8") or "idle")
+        elif op == OP_AUTH_STATUS:
+            self._handle_auth_status(bool(payload) and payload[0] != 0)
+        elif op == OP_PING:
+            self._handle_ping()
+        elif op == OP_QUIT:
+            self.shutdown()
+        else:
+            self.logger.warning("Unknown opcode: %#x", op)
+
+    def _process_message(self, message: bytes):
+        """Dispatch a single legacy JSON command message from a client."""
+        try:
+            # Malformed UTF-8 raises UnicodeDecodeError, and orjson's
+            # JSONDecodeError subclasses ValueError too, so every parse
+            # failure lands in this one branch
+            data = _json_loads(message)
+        except ValueError as e:
+            self.logger.warning("Invalid JSON message: %s", e)
+            return
+
+        command = data.get("command", "")
+        self.logger.debug("Received command: %s", command)
+
+        handler = self._handlers.get(command)
+        if handler is not None:
+            handler(data)
+        else:
+            self.logger.warning("Unknown command: %s", command)
+
+    def _handle_update_tooltip(self, tooltip: str):
+        # The Flutter side re-sends the tooltip on every status poll even
+        # when nothing changed; dedupe against the queued value when one
+        # is pending (comparing only against the applied state would drop
+        # the second leg of an A->B->A flap inside the flush window and
+        # leave B on screen), and cancel a pending update that returns to
+        # the applied value.
+        with self._flush_lock:
+            pending = self._pending_tooltip
+            if tooltip == (pending if pending is not None else self.tooltip):
+                return
+            if tooltip == self.tooltip:
+                self._pending_tooltip = None
+                return
+            self._pending_tooltip = tooltip
+            self._schedule_flush()
+
+    def _handle_update_icon(self, new_state: str):
+        with self._flush_lock:
+            pending = self._pending_icon
+            if new_state == (
+                pending if pending is not None else self.icon_state
+            ):
+                return
+            if new_state == self.icon_state:
+                self._pending_icon = None
+                return
+            self._pending_icon = new_state
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        """Arm the coalescing timer if it isn't already pending.
+
+        Caller must hold _flush_lock. A ~50ms window batches rapid
+        UPDATE_ICON/UPDATE_TOOLTIP flaps into a single pystray redraw —
+        only the latest pending value is applied.
+        """
+        if self._flush_timer is None:
+            self._flush_timer = threading.Timer(0.05, self._flush_tray)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def _flush_tray(self):
+        """Apply the latest coalesced icon/tooltip update in one shot."""
+        with self._flush_lock:
+            self._flush_timer = None
+            icon_state = self._pending_icon
+            tooltip = self._pending_tooltip
+            self._pending_icon = None
+            self._pending_tooltip = None
+        if icon_state is not None and icon_state != self.icon_state:
+            self.icon_state = icon_state
+            if self.tray:
+                self.tray.icon = self._create_icon_image(icon_state)
+        if tooltip is not None and tooltip != self.tooltip:
+            self.tooltip = tooltip
+            if self.tray:
+                self.tray.title = tooltip
+
+    def _handle_auth_status(self, authenticated: bool):
+        self.app_is_authenticated = authenticated
+        if self.tray:
+            self.tray.update_menu()
+        # Auth changes usually precede a burst of state churn; collapse
+        # the poll backoff so the next tick comes quickly.
+        self._request_poll()
+
+    def _handle_ping(self):
+        self._send_to_clients({"command": "PONG", "timestamp": time.time()})
+
+    def _encode_frame(self, message: dict) -> Optional[bytes]:
+        """Encode a command dict as a binary frame, or None if unmapped."""
+        op = _CMD_TO_OP.get(message.get("command"))
+        if op is None:
+            return None
+        extra = {k: v for k, v in message.items() if k != "command"}
+        payload = _json_dumps(extra) if extra else b""
+        return _FRAME_HEADER.pack(op, len(payload)) + payload
+
+    def _send_buffers(self, client: socket.socket, buffers: list):
+        """Write frames to a client, queueing whatever the kernel refuses.
+
+        sendmsg gathers the buffers without concatenating them first, so
+        a multi-frame broadcast (e.g. a PONG plus a status update) stays
+        one syscall and zero copies. Client sockets are non-blocking, so
+        a full send buffer means backpressure, not a dead peer: the
+        unsent tail goes into a per-client backlog, the selector starts
+        watching the socket for writability, and _flush_backlog drains
+        the queue in order once it clears — framing can't tear and a
+        transiently slow client isn't dropped. A backlog that grows past
+        _MAX_SEND_BACKLOG means the peer stopped reading; that raises so
+        the caller closes the client like any other send failure.
+        """
+        backlog = self._client_out.get(client)
+        if backlog is not None:
+            # Already backlogged: append behind the pending bytes to
+            # preserve frame order; EVENT_WRITE is armed already.
+            for buf in buffers:
+                backlog += buf
+            if len(backlog) > _MAX_SEND_BACKLOG:
+                raise OSError("client send backlog exceeded")
+            return
+        try:
+            if _HAS_SENDMSG:
+                sent = client.sendmsg(buffers, [], _SEND_FLAGS)
+            else:
+                sent = client.send(b"".join(buffers), _SEND_FLAGS)
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        total = sum(len(b) for b in buffers)
+        if sent == total:
+            return
+        self._client_out[client] = bytearray(b"".join(buffers)[sent:])
+        try:
+            self._selector.modify(
+                client,
+                selectors.EVENT_READ | selectors.EVENT_WRITE,
+                self._service_client,
+            )
+        except (KeyError, ValueError):
+            pass
+
+    def _service_client(self, client_socket: socket.socket):
+        """Selector callback for a backlogged client: flush, then read."""
+        self._flush_backlog(client_socket)
+        if client_socket in self._client_buffers:  # not closed by the flush
+            self._read_client(client_socket)
+
+    def _flush_backlog(self, client_socket: socket.socket):
+        """Drain a client's queued output now that its socket is writable."""
+        backlog = self._client_out.get(client_socket)
+        if backlog is None:
+            return
+        try:
+            sent = client_socket.send(backlog, _SEND_FLAGS)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            self.logger.debug("Backlog flush failed, dropping client: %s", e)
+            self._close_client(client_socket)
+            return
+        del backlog[:sent]
+        if not backlog:
+            del self._client_out[client_socket]
+            try:
+                self._selector.modify(
+                    client_socket, selectors.EVENT_READ, self._read_client
+                )
+            except (KeyError, ValueError):
+                pass
+
+    def _send_to_clients(self, message: dict):
+        """Broadcast a message to all connected clients.
+
+        Each representation is encoded at most once, and every frame is
+        written in full or queued in order (see _send_buffers), so short
+        writes can't silently truncate a message.
+        """
+        json_payload = _json_dumps(message) + b"\n"
+        frame = self._encode_frame(message) if self._binary_clients else None
+        disconnected_clients = []
+        with self._clients_lock:
+            clients = list(self.client_connections)
+        for client in clients:
+            payload = (
+                frame
+                if frame is not None and client in self._binary_clients
+                else json_payload
+            )
+            try:
+                self._send_buffers(client, [payload])
+            except Exception as e:
+                self.logger.debug("Send failed, marking client dead: %s", e)
+                disconnected_clients.append(client)
+        for client in disconnected_clients:
+            self._close_client(client)
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+
+    def start_tray(self):
+        """Create the tray icon and run the pystray event loop (blocking).
+
+        Failure is non-fatal: constructing a throwaway probe icon up front
+        could hang or stall startup on some backends, so the daemon just
+        tries for real and falls back to IPC-only degraded mode — the
+        Flutter app still gets its commands without a tray icon.
+        """
+        try:
+            _load_tray_modules()
+            self.tray = pystray.Icon(
+                "cloudtolocalllm",
+                icon=self._create_icon_image(self.icon_state),
+                title=self.tooltip,
+                menu=self._create_menu(),
+            )
+            self.tray.run()
+        except Exception as e:
+            self.tray = None
+            self.tray_degraded = True
+            try:
+                backends = self._check_available_backends()
+            except Exception:
+                backends = []
+            self.logger.error(
+                "System tray unavailable, continuing in IPC-only mode: %s "
+                "(backends: %s)", e, backends or "none",
+            )
+
+    def run(self) -> int:
+        """Run the daemon: IPC server, state polling, and tray event loop.
+
+        pystray's run() blocks its calling thread, so it gets a dedicated
+        worker thread; the main thread drives the selector loop — which
+        also owns the app-state poll tick — and stays responsive for
+        signal handling and shutdown.
+        """
+        self.logger.info("Starting CloudToLocalLLM tray daemon v%s", DAEMON_VERSION)
+
+        self.running = True
+        self.start_server()
+
+        self._start_state_watcher()
+        self._export_icon_files()
+        self.tray_thread = threading.Thread(
+            target=self.start_tray, name="pystray", daemon=False
+        )
+        self.tray_thread.start()
+
+        # IPC on the main thread; returns once shutdown clears self.running
+        self._serve_ipc()
+
+        if self.tray_thread.is_alive():
+            self.tray_thread.join(timeout=5)
+        return 0
+
+    def shutdown(self):
+        """Stop the daemon and clean up sockets, threads, and the port file."""
+        if not self.running:
+            return
+        self.logger.info("Shutting down tray daemon")
+        self.running = False
+        self._request_poll()  # Wake the selector loop so it exits promptly
+
+        with self._flush_lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+
+        if self._state_observer:
+            try:
+                self._state_observer.stop()
+            except Exception:
+                pass
+            self._state_observer = None
+
+        for client in list(self.client_connections):
+            self._close_client(client)
+
+        if self.server_socket:
+            try:
+                self.server_socket.close()
+            except OSError:
+                pass
+            self.server_socket = None
+
+        if self._selector:
+            try:
+                self._selector.close()
+            except OSError:
+                pass
+            self._selector = None
+
+        for sock in (self._wake_r, self._wake_w):
+            if sock is not None:
+                try:
+                    sock.close()
+                except OSError:
+                    pass
+        self._wake_r = self._wake_w = None
+
+        for stale in (self._endpoint_file_path, self._port_file_path,
+                      self._socket_path):
+            try:
+                if stale.exists():
+                    stale.unlink()
+            except OSError as e:
+                self.logger.warning("Failed to remove %s: %s", stale.name, e)
+
+        if self.tray:
+            try:
+                self.tray.stop()
+            except Exception:
+                pass
+
+        if self._log_listener:
+            try:
+                self._log_listener.stop()
+            except Exception:
+                pass
+            self._log_listener = None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="CloudToLocalLLM System Tray Daemon"
+    )
+    parser.add_argument(
+        "--debug", action="store_true", help="Enable debug logging to stderr"
+    )
+    parser.add_argument(
+        "--tcp", action="store_true",
+        help="Serve IPC over TCP loopback instead of a Unix domain socket",
+    )
+    parser.add_argument(
+        "--version", action="version",
+        version=f"CloudToLocalLLM Tray Daemon {DAEMON_VERSION}",
+    )
+    args = parser.parse_args()
+
+    daemon = TrayDaemon(debug=args.debug, use_tcp=args.tcp)
+
+    def handle_signal(signum, frame):
+        daemon.shutdown()
+
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+
+    return daemon.run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
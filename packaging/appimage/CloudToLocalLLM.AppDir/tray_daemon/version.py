@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+CloudToLocalLLM Tray Daemon Version Management
+
+Single source of truth for the tray daemon version, its IPC API version,
+compatibility with the main Flutter app and tunnel manager, and the
+config migrations between daemon versions.
+
+Usage:
+    python3 version.py --version
+    python3 version.py --detailed
+    python3 version.py --json
+    python3 version.py --compatibility
+"""
+
+import sys
+from functools import lru_cache
+from typing import Dict, List, NamedTuple
+
+# Version of the tray daemon itself. Interned so steady-state checks
+# against it (see needs_migration) reduce to a pointer compare.
+TRAY_DAEMON_VERSION = sys.intern("2.0.0")
+TRAY_DAEMON_BUILD = 1
+BUILD_TIMESTAMP = "2025-06-04T00:00:00Z"
+GIT_COMMIT = "unknown"
+
+# Version of the IPC protocol spoken over the tray socket
+API_VERSION = "1.0"
+
+# Versions of the other components this daemon can talk to. Tuples, not
+# lists: immutable, shareable without defensive copies, and hashable so
+# cached functions can key on them.
+COMPATIBLE_MAIN_APP_VERSIONS = ("3.2.0", "3.1.3")
+COMPATIBLE_TUNNEL_MANAGER_VERSIONS = ("1.0.0", "0.9.0")
+
+MINIMUM_PYTHON_VERSION = (3, 8)
+
+# Display strings are pure functions of the constants above, so they are
+# formatted once at import and the formatters below just return them —
+# no f-string work in the tray-tooltip refresh path.
+_FULL_VERSION = f"{TRAY_DAEMON_VERSION}+{TRAY_DAEMON_BUILD}"
+_DISPLAY = f"Tray Daemon v{_FULL_VERSION}"
+_DETAILED = f"{_DISPLAY} ({BUILD_TIMESTAMP})"
+_TOOLTIP = f"CloudToLocalLLM Tray v{TRAY_DAEMON_VERSION}"
+_MIN_PYTHON_STR = ".".join(str(part) for part in MINIMUM_PYTHON_VERSION)
+_PYTHON_VERSION_STR = (
+    f"{sys.version_info.major}.{sys.version_info.minor}"
+    f".{sys.version_info.micro}"
+)
+
+# App-type keys are interned so the dict lookups below hit CPython's
+# pointer-equality fast path before falling back to full string compares
+_MAIN_APP = sys.intern("main_app")
+_TUNNEL_MANAGER = sys.intern("tunnel_manager")
+
+# major.minor prefixes of the supported versions, computed once at import
+# so a compatibility check is one rsplit plus a set membership; the
+# stored prefixes are interned for the same identity shortcut
+_COMPAT_MAJOR_MINOR = {
+    _MAIN_APP: frozenset(
+        sys.intern(v.rsplit(".", 1)[0]) for v in COMPATIBLE_MAIN_APP_VERSIONS
+    ),
+    _TUNNEL_MANAGER: frozenset(
+        sys.intern(v.rsplit(".", 1)[0])
+        for v in COMPATIBLE_TUNNEL_MANAGER_VERSIONS
+    ),
+}
+
+
+@lru_cache(maxsize=512)
+def _parse_semver(version: str) -> tuple:
+    """Parse a dotted version string into a cached tuple of ints.
+
+    The daemon compares the same handful of version strings over and
+    over (startup handshake, compatibility scans), so the split/int work
+    is paid once per distinct string and every later comparison starts
+    from the cached tuple.
+    """
+    return tuple(int(part) for part in version.split("."))
+
+
+def compare_versions(version1: str, version2: str) -> int:
+    """Compare two dotted versions: -1 if v1 < v2, 0 if equal, 1 if v1 > v2.
+
+    Shorter versions are padded with zeros, so "2.0" == "2.0.0".
+    """
+    # Equal strings mean equal versions; skip the parse-cache lookups
+    # entirely on the common same-version case (identity first, since
+    # interned strings make it a pointer compare)
+    if version1 is version2 or version1 == version2:
+        return 0
+    a = _parse_semver(version1)
+    b = _parse_semver(version2)
+    length = max(len(a), len(b))
+    a += (0,) * (length - len(a))
+    b += (0,) * (length - len(b))
+    # CPython compares tuples lexicographically in C; one COMPARE_OP per
+    # side beats a Python-level loop of per-element branches
+    return (a > b) - (a < b)
+
+
+def validate_version_format(version: str) -> bool:
+    """Check that a version string is three dot-separated integers.
+
+    Walks the string with find() instead of split() — no list
+    allocation — and validates segments with str.isdigit, which is far
+    cheaper than round-tripping each one through int() just to throw
+    the result away.
+    """
+    first = version.find(".")
+    if first == -1:
+        return False
+    second = version.find(".", first + 1)
+    if second == -1 or version.find(".", second + 1) != -1:
+        return False
+    for segment in (version[:first], version[first + 1:second],
+                    version[second + 1:]):
+        if not (segment and segment.isascii() and segment.isdigit()):
+            return False
+    return True
+
+
+def is_version_newer(version1: str, version2: str) -> bool:
+    """Return True if version1 is strictly newer than version2."""
+    return compare_versions(version1, version2) > 0
+
+
+def needs_migration(from_version: str) -> bool:
+    """Return True if a config written by from_version needs migrating."""
+    if from_version == TRAY_DAEMON_VERSION:  # steady state on every startup
+        return False
+    return compare_versions(from_version, TRAY_DAEMON_VERSION) < 0
+
+
+class VersionInfo(NamedTuple):
+    """Version metadata record.
+
+    A NamedTuple instead of a dict: field access is a C-level slot read
+    rather than a hash lookup, the record is immutable, and one frozen
+    instance can be shared by every caller.
+    """
+
+    version: str
+    build: int
+    full_version: str
+    api_version: str
+    build_timestamp: str
+    git_commit: str
+    python_version: str
+    compatible_main_app: tuple
+    compatible_tunnel_manager: tuple
+
+
+_VERSION_INFO = VersionInfo(
+    version=TRAY_DAEMON_VERSION,
+    build=TRAY_DAEMON_BUILD,
+    full_version=_FULL_VERSION,
+    api_version=API_VERSION,
+    build_timestamp=BUILD_TIMESTAMP,
+    git_commit=GIT_COMMIT,
+    python_version=_PYTHON_VERSION_STR,
+    compatible_main_app=COMPATIBLE_MAIN_APP_VERSIONS,
+    compatible_tunnel_manager=COMPATIBLE_TUNNEL_MANAGER_VERSIONS,
+)
+
+
+def get_version_info() -> VersionInfo:
+    """Return the version metadata record (a shared immutable singleton)."""
+    return _VERSION_INFO
+
+
+def get_version_info_dict() -> Dict:
+    """Return the version metadata as a JSON-serializable dict.
+
+    Keeps the historical dict shape (nested compatible_apps) for the
+    CLI --json output and any caller that serializes the metadata.
+    """
+    return {
+        "version": TRAY_DAEMON_VERSION,
+        "build": TRAY_DAEMON_BUILD,
+        "full_version": _FULL_VERSION,
+        "api_version": API_VERSION,
+        "build_timestamp": BUILD_TIMESTAMP,
+        "git_commit": GIT_COMMIT,
+        "python_version": _PYTHON_VERSION_STR,
+        "compatible_apps": {
+            _MAIN_APP: COMPATIBLE_MAIN_APP_VERSIONS,
+            _TUNNEL_MANAGER: COMPATIBLE_TUNNEL_MANAGER_VERSIONS,
+        },
+    }
+
+
+@lru_cache(maxsize=64)
+def is_app_compatible(app_version: str, app_type: str = _MAIN_APP) -> bool:
+    """Check whether an app version is compatible with this daemon.
+
+    Compatibility is decided on major.minor: a patch release of a
+    supported version is always accepted. The supported prefixes are
+    precomputed per app type, so a check is one rsplit and a frozenset
+    membership test.
+    """
+    prefixes = _COMPAT_MAJOR_MINOR.get(app_type)
+    if prefixes is None:
+        return False
+    return app_version.rsplit(".", 1)[0] in prefixes
+
+
+def check_python_compatibility() -> bool:
+    """Check that the running interpreter meets the minimum version."""
+    return sys.version_info[:2] >= MINIMUM_PYTHON_VERSION
+
+
+def get_compatibility_report() -> Dict:
+    """Return a full compatibility report for diagnostics."""
+    return {
+        "daemon_version": TRAY_DAEMON_VERSION,
+        "api_version": API_VERSION,
+        "python": {
+            "version": _PYTHON_VERSION_STR,
+            "compatible": check_python_compatibility(),
+            "minimum_required": _MIN_PYTHON_STR,
+        },
+        "supported_versions": {
+            _MAIN_APP: COMPATIBLE_MAIN_APP_VERSIONS,
+            _TUNNEL_MANAGER: COMPATIBLE_TUNNEL_MANAGER_VERSIONS,
+        },
+    }
+
+
+def format_version_for_display() -> str:
+    """Return the version string shown in UIs and logs."""
+    return _DISPLAY
+
+
+def format_detailed_version() -> str:
+    """Return the display version with the build timestamp."""
+    return _DETAILED
+
+
+def get_tooltip_version() -> str:
+    """Return the short version string used in the tray tooltip."""
+    return _TOOLTIP
+
+
+class TrayDaemonVersion:
+    """Backward-compatible shim over the module-level functions.
+
+    The class held no state; calling through it paid LOAD_ATTR plus the
+    staticmethod descriptor unwrap per call. New code should call the
+    module functions directly — one LOAD_GLOBAL and the call.
+    """
+
+    get_version_info = staticmethod(get_version_info)
+    get_version_info_dict = staticmethod(get_version_info_dict)
+    is_app_compatible = staticmethod(is_app_compatible)
+    check_python_compatibility = staticmethod(check_python_compatibility)
+    get_compatibility_report = staticmethod(get_compatibility_report)
+    format_version_for_display = staticmethod(format_version_for_display)
+    format_detailed_version = staticmethod(format_detailed_version)
+    get_tooltip_version = staticmethod(get_tooltip_version)
+
+
+# Migration steps indexed by (from major.minor, to major.minor): a path
+# lookup is two rsplits and one dict access instead of a scan over every
+# entry with per-entry rsplit/startswith work
+_MIGRATION_INDEX = {
+    ("1.0", "2.0"): ("migrate_config_format", "migrate_ipc_protocol"),
+    ("1.1", "2.0"): ("migrate_ipc_protocol",),
+}
+
+
+def get_migration_path(from_version: str, to_version: str) -> List[str]:
+    """Return the migration steps from one version to another."""
+    from_key = from_version.rsplit(".", 1)[0]
+    to_key = to_version.rsplit(".", 1)[0]
+    return list(_MIGRATION_INDEX.get((from_key, to_key), ()))
+
+
+def get_migration_info(from_version: str) -> Dict:
+    """Summarize what migrating from from_version involves."""
+    return {
+        "from_version": from_version,
+        "to_version": TRAY_DAEMON_VERSION,
+        "needs_migration": needs_migration(from_version),
+        "steps": get_migration_path(from_version, TRAY_DAEMON_VERSION),
+    }
+
+
+class VersionMigration:
+    """Backward-compatible shim over the migration functions."""
+
+    get_migration_path = staticmethod(get_migration_path)
+    get_migration_info = staticmethod(get_migration_info)
+
+
+if __name__ == "__main__":
+    import json
+
+    # Flag dispatch via dict lookup instead of a chain of string
+    # compares; unknown or missing flags fall back to the display string
+    _DISPATCH = {
+        "--version": lambda: _FULL_VERSION,
+        "--detailed": lambda: _DETAILED,
+        "--json": lambda: json.dumps(get_version_info_dict(), indent=2),
+        "--compatibility": lambda: json.dumps(
+            get_compatibility_report(), indent=2
+        ),
+    }
+    arg = sys.argv[1] if len(sys.argv) > 1 else ""
+    print(_DISPATCH.get(arg, lambda: _DISPLAY)())